@@ -0,0 +1,355 @@
+"""
+Benchmarks for the uno server. Run with:
+
+	python benchmark.py <benchmark> [options]
+"""
+
+from optparse import OptionParser
+from os.path import dirname, abspath, join
+from subprocess import Popen, DEVNULL
+from tempfile import TemporaryDirectory
+from statistics import median
+from time import perf_counter, sleep
+from threading import active_count
+from types import SimpleNamespace
+from random import sample
+from array import array
+from sys import executable
+import tracemalloc
+import socket
+
+from highway import Route
+
+from lobby import lobbies, games, event_lock, Lobby, LocalUser, Uno, Seat
+from cards import ALL_CARDS
+from routes import create_routes
+from bots import Bot
+import matchmaking
+import variants
+from replay import replay
+
+SERVER_PATH = join(dirname(abspath(__file__)), "server.py")
+
+PLAYERS_PER_LOBBY = 4
+
+HANDSHAKE = ("GET / HTTP/1.1\r\n"
+	"Host: %s:%d\r\n"
+	"Upgrade: websocket\r\n"
+	"Connection: Upgrade\r\n"
+	"Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n"
+	"Sec-WebSocket-Version: 13\r\n\r\n")
+
+
+def create_games(users):
+	for index in range(0, len(users), PLAYERS_PER_LOBBY):
+		host = users[index]
+		lobby = Lobby("lobby%d" % index, host)
+		lobbies[lobby.name] = lobby
+		host.lobby = lobby
+		for user in users[index + 1:index + PLAYERS_PER_LOBBY]:
+			lobby.join(user)
+		lobby.start(host)
+		# No turn timers needed, turns are driven by the benchmark or bots
+		if lobby.game != None:
+			lobby.game.turn_timer.cancel()
+
+
+def stop_games():
+	for lobby in list(lobbies.values()):
+		lobby.stop()
+	lobbies.clear()
+
+
+def simulate(seed, player_count, max_events=5000, game_name="uno"):
+	"""
+	Plays a seeded game with a simple strategy: play the first card that
+	fits, otherwise draw, otherwise let the turn expire.
+	"""
+	users = [LocalUser("user%d" % index) for index in range(player_count)]
+	lobby = Lobby("simulation", users[0])
+	lobbies[lobby.name] = lobby
+	users[0].lobby = lobby
+	for user in users[1:]:
+		lobby.join(user)
+	lobby.playing = True
+	lobby.game = game = games[game_name](lobby, turn_time=None, seed=seed)
+
+	while lobby.game is game and len(game.log) < max_events:
+		player = game.playing_player
+		cards = game.seats[player].cards
+		playable = game.playable_cards()
+		for index, card_id in enumerate(cards):
+			if playable[card_id]:
+				game.play_card(index, player)
+				break
+		else:
+			if game.seats[player].has_drawn_card:
+				game.turn_time_expired()
+			else:
+				game.draw_card(player)
+
+	stop_games()
+	return game
+
+
+def game_state(game):
+	return (bytes(game.card_stack), [bytes(seat.cards)
+		for seat in game.seats.values()])
+
+
+def free_port(address="127.0.0.1"):
+	sock = socket.socket()
+	sock.bind((address, 0))
+	port = sock.getsockname()[1]
+	sock.close()
+	return port
+
+
+def handshake(address, port):
+	"""
+	Returns True once the server accepted and upgraded a websocket
+	connection.
+	"""
+	try:
+		sock = socket.create_connection((address, port), timeout=1.0)
+	except OSError:
+		return False
+	try:
+		sock.sendall((HANDSHAKE % (address, port)).encode())
+		return sock.recv(1024).startswith(b"HTTP/1.1 101")
+	except OSError:
+		return False
+	finally:
+		sock.close()
+
+
+def rss(pid):
+	# Resident set size in KiB (Linux only)
+	try:
+		with open("/proc/%d/status" % pid) as status:
+			for line in status:
+				if line.startswith("VmRSS:"):
+					return int(line.split()[1])
+	except IOError:
+		pass
+	return None
+
+
+def children(pid):
+	try:
+		with open("/proc/%d/task/%d/children" % (pid, pid)) as file:
+			return [int(child) for child in file.read().split()]
+	except IOError:
+		return []
+
+
+def spawn_server(directory, port, extra_config="", address="127.0.0.1"):
+	with open(join(directory, "uno.cfg"), "w") as config:
+		config.write('address = "%s"\nport = %d\n%s' % (address, port,
+			extra_config))
+	return Popen([executable, SERVER_PATH], cwd=directory,
+		stdout=DEVNULL, stderr=DEVNULL)
+
+
+def bench_startup(options):
+	accept_times = []
+	rss_values = []
+	for _ in range(options.runs):
+		with TemporaryDirectory() as directory:
+			port = free_port()
+			start = perf_counter()
+			process = spawn_server(directory, port,
+				extra_config="workers = %d\n" % options.workers)
+			try:
+				while not handshake("127.0.0.1", port):
+					if process.poll() != None:
+						raise RuntimeError("server exited with code %d" %
+							process.returncode)
+					sleep(0.001)
+				accept_times.append(perf_counter() - start)
+				# Prefork mode: workers (and the index manager) are children
+				# of the supervisor
+				pids = children(process.pid) if options.workers > 1 else \
+					[process.pid]
+				rss_values += [rss(pid) for pid in pids]
+			finally:
+				process.terminate()
+				process.wait()
+
+	print("time to first accept: %.1f ms (median of %d, min %.1f ms)" % (
+		median(accept_times) * 1000, options.runs, min(accept_times) * 1000))
+	if rss_values and not None in rss_values:
+		print("baseline rss per worker: %d KiB" % median(rss_values))
+
+
+# Returns what create() returns and the bytes it allocated
+def traced(create):
+	tracemalloc.start()
+	baseline = tracemalloc.get_traced_memory()[0]
+	result = create()
+	used = tracemalloc.get_traced_memory()[0] - baseline
+	tracemalloc.stop()
+	return result, used
+
+
+# Per player Uno state as it was kept before seats: User.games (only used
+# for this) holding a namespace with a list of Card objects
+def legacy_seats(hands):
+	seats = []
+	for hand in hands:
+		player_games = SimpleNamespace()
+		player_games.uno = SimpleNamespace()
+		player_games.uno.turn_over = True
+		player_games.uno.has_drawn_card = False
+		player_games.uno.cards = [ALL_CARDS[card_id] for card_id in hand]
+		seats.append(player_games)
+	return seats
+
+
+def seats(hands):
+	return [Seat(array("B", hand)) for hand in hands]
+
+
+def bench_memory(options):
+	# Same starting hands for both layouts
+	hands = [sample(range(len(ALL_CARDS)), 7)
+		for _ in range(options.players)]
+	_, before = traced(lambda: legacy_seats(hands))
+	_, after = traced(lambda: seats(hands))
+	print("uno state per player: %d bytes before (namespaces, list of "
+		"cards), %d bytes now (Seat, array of card ids)" % (
+		before / options.players, after / options.players))
+
+	users = [LocalUser("user%d" % index)
+		for index in range(options.players)]
+	_, used = traced(lambda: create_games(users))
+	stop_games()
+
+	print("game state per active player: %d bytes (%d players, %d per lobby; "
+		"lobbies, games, chats, spectators and replay logs included)" % (
+		used / options.players, options.players, PLAYERS_PER_LOBBY))
+
+
+def bench_replay(options):
+	events = 0
+	elapsed = 0.0
+	for seed in range(options.runs):
+		game = simulate(seed, PLAYERS_PER_LOBBY, game_name=options.game)
+		start = perf_counter()
+		replayed = replay(game.log)
+		elapsed += perf_counter() - start
+		events += len(game.log)
+		stop_games()
+
+		if game_state(replayed) != game_state(game):
+			raise RuntimeError("replay of seed %d diverged" % seed)
+
+	print("replayed %d events of %d %s games: %.0f events/s" % (events,
+		options.runs, options.game, events / elapsed))
+
+
+def bench_bots(options):
+	# Bots move as soon as it's their turn
+	Bot.think_time = 0.0
+	bots = [Bot.create() for _ in range(options.players)]
+	threads = active_count()
+
+	start = perf_counter()
+	with event_lock:
+		create_games(bots)
+		games = [lobby.game for lobby in lobbies.values()]
+	while any(lobby.playing for lobby in lobbies.values()):
+		sleep(0.001)
+	elapsed = perf_counter() - start
+	stop_games()
+
+	moves = sum(len(game.log) for game in games)
+	print("%d bots finished %d games: %.0f moves/s, %d extra threads" % (
+		options.players, len(games), moves / elapsed,
+		active_count() - threads))
+
+
+def bench_matchmaking(options):
+	users = [LocalUser("user%d" % index)
+		for index in range(options.players)]
+
+	start = perf_counter()
+	with event_lock:
+		for user in users:
+			matchmaking.queue.add(user)
+	elapsed = perf_counter() - start
+	stop_games()
+
+	metrics = matchmaking.queue.metrics()
+	print("matched %d players into %d games: %.0f players/s, median wait %.1f"
+		" ms" % (metrics["matched"], len(users) // matchmaking.size,
+		len(users) / elapsed, metrics["medianWait"] * 1000))
+
+
+class TypeCheckedSync(Route):
+	def run(self, data, handler):
+		if handler.lobby != None and type(handler.lobby.game) is Uno:
+			handler.lobby.game.sync(handler)
+			return
+		handler.send(False, "uno_sync")
+
+
+def bench_dispatch(options):
+	users = [LocalUser("user%d" % index)
+		for index in range(PLAYERS_PER_LOBBY)]
+	create_games(users)
+	user = users[0]
+	route = create_routes()["uno_sync"]
+	messages = options.runs * 10000
+
+	# Through the command table of the game
+	start = perf_counter()
+	for _ in range(messages):
+		route.run(None, user)
+	routed = perf_counter() - start
+
+	# Type check per route like before the game registry
+	checked_route = TypeCheckedSync()
+	start = perf_counter()
+	for _ in range(messages):
+		checked_route.run(None, user)
+	checked = perf_counter() - start
+
+	start = perf_counter()
+	for _ in range(messages):
+		user.lobby.game.sync(user)
+	direct = perf_counter() - start
+	stop_games()
+
+	print("uno_sync: %.0f ns routed, %.0f ns type checked, %.0f ns direct "
+		"(dispatch overhead %.0f ns per message)" % (routed / messages * 1e9,
+		checked / messages * 1e9, direct / messages * 1e9,
+		(routed - direct) / messages * 1e9))
+
+
+BENCHMARKS = {
+	"startup" : bench_startup,
+	"memory" : bench_memory,
+	"replay" : bench_replay,
+	"bots" : bench_bots,
+	"matchmaking" : bench_matchmaking,
+	"dispatch" : bench_dispatch
+}
+
+
+if __name__ == "__main__":
+	parser = OptionParser(usage="%%prog [options] {%s}" %
+		",".join(sorted(BENCHMARKS)))
+	parser.add_option("-r", "--runs", action="store", type="int",
+		dest="runs", default=10)
+	parser.add_option("-w", "--workers", action="store", type="int",
+		dest="workers", default=1)
+	parser.add_option("-p", "--players", action="store", type="int",
+		dest="players", default=4000)
+	parser.add_option("-g", "--game", action="store", type="choice",
+		dest="game", choices=sorted(games), default="uno")
+	options, args = parser.parse_args()
+
+	if len(args) != 1 or args[0] not in BENCHMARKS:
+		parser.error("pick one benchmark")
+	BENCHMARKS[args[0]](options)
@@ -0,0 +1,77 @@
+"""
+Server-side bot players. Bots fill empty seats (lobby_add_bot) and take
+over the seats of players leaving a running game.
+
+A bot reacts to the same messages a client gets and plays through the same
+Uno.play_card / draw_card calls. Moves run on the scheduler thread, bots
+don't have threads of their own.
+"""
+
+from itertools import count
+
+from cards import WILD
+from lobby import LocalUser, Uno, event_lock, claim_name
+from scheduler import call_later
+
+
+def choose_card(cards, playable):
+	"""
+	Returns the index of the card to play or None if nothing fits. playable
+	is a row of cards.PLAYABLE (Uno.playable_cards()). Wild cards are saved
+	for when nothing else fits.
+	"""
+	wild = None
+	for index, card_id in enumerate(cards):
+		if playable[card_id]:
+			if not WILD[card_id]:
+				return index
+			if wild == None:
+				wild = index
+	return wild
+
+
+class Bot(LocalUser):
+	bot = True
+	# Seconds before a move is made
+	think_time = 1.0
+
+	numbers = count(1)
+
+	@staticmethod
+	def create():
+		# Names are claimed like user names, nobody can log in as a bot
+		while True:
+			name = "Bot %d" % next(Bot.numbers)
+			if claim_name(name):
+				return Bot(name)
+
+
+	def send(self, data, route, indexed_dict=False, json_encoder=None):
+		if route == "uno_turn":
+			if data is self:
+				call_later(self.think_time, self.move)
+		# Turn goes on after pick color, take four or drawing a card that
+		# fits. Failed moves are left to the turn timer.
+		elif route in ("uno_play_card", "uno_draw_card"):
+			if data and self.in_game(Uno) and \
+				self.lobby.game.playing_player is self:
+				call_later(self.think_time, self.move)
+
+
+	def move(self):
+		with event_lock:
+			# Game ended or turn expired while thinking
+			if not self.in_game(Uno):
+				return
+			game = self.lobby.game
+			if game.playing_player is not self:
+				return
+
+			seat = game.seats[self]
+			index = choose_card(seat.cards, game.playable_cards())
+			if index != None:
+				game.play_card(index, self)
+			elif not seat.has_drawn_card:
+				game.draw_card(self)
+			else:
+				game.turn_time_expired()
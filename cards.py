@@ -79,6 +79,10 @@ class Card:
 		return False
 
 
+def from_ids(card_ids):
+	return [ALL_CARDS[card_id] for card_id in card_ids]
+
+
 def can_play(player_cards, card):
 	for card_ in player_cards:
 		if card.can_play(card_):
@@ -103,3 +107,21 @@ take_four = Card(TAKE_FOUR)
 ALL_CARDS.append(pick_color)
 ALL_CARDS.append(take_four)
 
+# Games store cards by their index in ALL_CARDS (fits in a byte)
+for card_id, card in enumerate(ALL_CARDS):
+	card.id = card_id
+
+
+# Playability rules as lookup tables: PLAYABLE[top card id][card id] is 1 if
+# the card can be played on top of the other one
+PLAYABLE = [bytes(top.can_play(card) for card in ALL_CARDS)
+	for top in ALL_CARDS]
+WILD = bytes(card.color == None for card in ALL_CARDS)
+
+
+# playable is a row of PLAYABLE (or of a variant's own table)
+def can_play_ids(card_ids, playable):
+	for card_id in card_ids:
+		if playable[card_id]:
+			return True
+	return False
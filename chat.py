@@ -0,0 +1,50 @@
+"""
+Lobby chat. The last HISTORY_SIZE messages are kept in a ring buffer and
+sent to joining players in one frame (lobby_chat_history). Messages
+arriving within WINDOW seconds are delivered together as a list on
+lobby_chat_messages.
+
+Both routes are optional for clients, clients that don't know them get no
+history and every message on its own on lobby_chat_message.
+"""
+
+from collections import deque
+
+HISTORY_SIZE = 50
+WINDOW = 0.05
+
+
+def knows_route(user, route):
+	return route in user.peer_reverse_exchange_routes
+
+
+class Chat:
+	def __init__(self):
+		self.history = deque(maxlen=HISTORY_SIZE)
+		# Not delivered yet
+		self.pending = []
+
+
+	# Returns True for the first message of a batch, the lobby schedules
+	# the flush
+	def add(self, player, message):
+		self.pending.append({"player" : player.name, "message" : message})
+		return len(self.pending) == 1
+
+
+	def flush(self, players):
+		batch = self.pending
+		self.pending = []
+		# Players joining before the flush get the batch, not the history
+		self.history.extend(batch)
+		for player in players:
+			if knows_route(player, "lobby_chat_messages"):
+				player.send(batch, "lobby_chat_messages")
+			else:
+				for entry in batch:
+					player.send(entry, "lobby_chat_message")
+
+
+	def send_history(self, player):
+		if self.history and knows_route(player, "lobby_chat_history"):
+			player.send(list(self.history), "lobby_chat_history")
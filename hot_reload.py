@@ -0,0 +1,80 @@
+"""
+Zero downtime reload of the stateless modules (cards and routes).
+
+Modules holding state (lobby, server) can't be reloaded this way because
+every socket and game references their classes and containers. The reload
+runs while holding the event lock so it always happens between two lobby
+events and never in the middle of a turn.
+"""
+
+from importlib import reload
+
+from highway import logging
+from highway.utils import capture_trace
+
+import cards
+import routes
+import lobby
+import bots
+import variants
+
+from lobby import lobbies, event_lock
+
+
+def rebind(module, old_namespace, new_module):
+	# Update names that were imported with "from module import name"
+	for name, value in list(vars(module).items()):
+		if name in old_namespace and value is old_namespace[name] and \
+			hasattr(new_module, name):
+			setattr(module, name, getattr(new_module, name))
+
+
+def reload_cards():
+	old_namespace = dict(vars(cards))
+	reload(cards)
+	rebind(lobby, old_namespace, cards)
+	rebind(bots, old_namespace, cards)
+	rebind(variants, old_namespace, cards)
+	# Lookup tables derived from the cards
+	variants.build_tables()
+
+	# Running games store card ids, which change if ALL_CARDS was reordered
+	new_cards = {(card.face, card.color) : card for card in cards.ALL_CARDS}
+	ids = {card.id : new_cards[(card.face, card.color)].id
+		for card in old_namespace["ALL_CARDS"]
+		if (card.face, card.color) in new_cards}
+	for lobby_ in lobbies.values():
+		if lobby_.game != None:
+			lobby_.game.reload_cards(ids)
+
+
+def reload_routes(app, websockets):
+	reload(routes)
+	new_routes = routes.create_routes()
+
+	# New connections
+	app.routes.update(new_routes)
+	# Connected handlers own a copy of the route table. Routes that did not
+	# exist on connect can't be added because the exchange map was already
+	# sent to the client.
+	for websocket in websockets:
+		for name in websocket.routes:
+			if name in new_routes:
+				websocket.routes[name] = new_routes[name]
+
+
+def hot_reload(app, manager):
+	with event_lock:
+		with manager.lock:
+			websockets = list(manager.websockets.values())
+		try:
+			reload_cards()
+			reload_routes(app, websockets)
+		except Exception:
+			logging.error("Reload failed, old code stays active where possible.")
+			capture_trace()
+			return False
+
+	logging.success("Reloaded cards and routes (%d connections kept)" %
+		len(websockets))
+	return True
@@ -0,0 +1,1045 @@
+from json import JSONEncoder
+from random import choice, getrandbits
+from threading import Lock, RLock
+from array import array
+from time import thread_time
+
+from highway import Server
+from highway import logging
+
+from cards import ALL_CARDS, REGULAR_CARDS
+from cards import ROTATE, BLOCK, TAKE_TWO, TAKE_FOUR, PICK_COLOR
+from cards import CardEncoder, PLAYABLE, can_play_ids, from_ids
+
+from utils import broadcast
+from spectators import Audience
+from chat import Chat, WINDOW
+from scheduler import call_later
+from prng import SplitMix
+from profiling import account
+from replay import EventLog
+from replay import PLAY_CARD, DRAW_CARD, TURN_EXPIRED, LEAVE, GIVE_CARD
+from replay import TAKEOVER, MAX_GAME_NAME
+
+taken_names = []
+lobbies = {}
+
+# Held while a lobby event (message, disconnect, expired turn) is processed.
+# Anything that swaps out code at runtime has to hold it as well.
+event_lock = RLock()
+
+# Set in prefork mode, shares user and lobby names with the other workers
+# and hands users over to the worker owning a lobby (see prefork.py)
+cluster = None
+
+CHEAT_PARSER = None
+
+
+# Game name -> Game subclass, lobbies play one of these
+games = {}
+
+
+def register_game(game):
+	# Replays store the name in a fixed size field
+	if len(game.name.encode()) > MAX_GAME_NAME:
+		raise ValueError("Game name '%s' is longer than %d bytes" % (
+			game.name, MAX_GAME_NAME))
+	games[game.name] = game
+	return game
+
+
+# Routes of all registered games
+def game_routes():
+	return {route for game in games.values() for route in game.commands}
+
+
+# Built on first use, regular chat messages never need it
+def cheat_parser():
+	global CHEAT_PARSER
+	if CHEAT_PARSER == None:
+		from optparse import OptionParser
+		CHEAT_PARSER = OptionParser()
+		CHEAT_PARSER.add_option("-f", "--face", action="store", type="int", 
+			dest="face", default=0)
+		CHEAT_PARSER.add_option("-c", "--color", action="store", type="int", 
+			dest="color", default=None)
+		CHEAT_PARSER.add_option("-a", "--amount", action="store", type="int", 
+			dest="amount", default=1)
+		CHEAT_PARSER.add_option("-p", "--player", action="store", type="string", 
+			dest="player", default=None)
+	return CHEAT_PARSER
+
+
+# /debug [-f face] [-c color] [-a amount] [-p player]
+def debug_command(lobby, player, arguments):
+	if not player.in_game(Uno):
+		return True
+
+	from shlex import split
+	try:
+		options, args = cheat_parser().parse_args(split(arguments))
+	# optparse exits on invalid options
+	except (ValueError, SystemExit):
+		return False
+
+	if options.player == None:
+		player_ = player
+	else:
+		# Only players of this game have a seat
+		for player_ in lobby.players:
+			if player_.name == options.player:
+				break
+		else:
+			return False
+	for _ in range(options.amount):
+		lobby.game.give_card(options.face, options.color, player_)
+	return True
+
+
+# Chat commands, never forwarded to the other players
+COMMANDS = {"/debug" : debug_command}
+
+
+# Meant to be called from to REPL to troll
+def give_cards(count, player_name):
+	player = find_player(player_name)
+	if player != None:
+		player.lobby.give_cards(count, player)
+
+
+def claim_name(name):
+	if name in taken_names:
+		return False
+	if cluster != None and not cluster.claim_name(name):
+		return False
+	taken_names.append(name)
+	return True
+
+
+def release_name(name):
+	del taken_names[taken_names.index(name)]
+	if cluster != None:
+		cluster.release_name(name)
+
+
+def claim_lobby(name):
+	if name in lobbies:
+		return False
+	return cluster == None or cluster.claim_lobby(name)
+
+
+def release_lobby(name):
+	del lobbies[name]
+	if cluster != None:
+		cluster.release_lobby(name)
+
+
+# Lobbies of all workers
+def list_lobbies():
+	if cluster == None:
+		return lobbies
+	listed = cluster.remote_lobbies()
+	listed.update(lobbies)
+	return listed
+
+
+# Returns False if no other worker owns the lobby
+def join_remote_lobby(name, player):
+	if cluster == None:
+		return False
+	return cluster.hand_over(player, name)
+
+
+# Returns False if no other worker owns the lobby
+def spectate_remote_lobby(name, user):
+	if cluster == None:
+		return False
+	return cluster.hand_over(user, name, route="lobby_spectate")
+
+
+def create_bot():
+	# bots imports this module
+	from bots import Bot
+	return Bot.create()
+
+
+def find_player(player_name):
+	for lobby in lobbies:
+		for player in lobbies[lobby].players:
+			if player_name == player.name:
+				return player
+	return None
+
+
+class LobbyEncoder(JSONEncoder):
+	def default(self, obj):
+		if isinstance(obj, Lobby):
+			return {
+				"host" : obj.host.name,
+				"playerCount" : obj.player_count,
+				"playing" : obj.playing,
+				"game" : obj.game_name
+				}
+		return JSONEncoder.default(self, obj)
+
+
+class UserEncoder(JSONEncoder):
+	def default(self, obj):
+		if isinstance(obj, User):
+			return obj.name
+		return JSONEncoder.default(self, obj)
+
+
+class Game:
+	# Registry name
+	name = None
+
+	# Route name -> (method name, type of the data or None if the method
+	# only takes the player). Routes don't know the games, they look the
+	# command up in the table of the game being played.
+	commands = {}
+
+	def __init__(self, lobby, debug=False):
+		self.lobby = lobby
+		self.debug = debug
+		# Route name -> (bound method, data type), resolved once per game
+		# so routes only do one lookup and call
+		self.dispatch = {route : (getattr(self, method), data_type)
+			for route, (method, data_type) in self.commands.items()}
+
+
+	# Public events also go to the spectators
+	def broadcast(self, data, route, exclude=None, json_encoder=None):
+		broadcast(data, route, self.lobby.players, exclude=exclude,
+			json_encoder=json_encoder)
+		self.lobby.spectators.publish(data, route, json_encoder=json_encoder)
+
+
+	def player_leave(self, player):
+		pass
+
+
+	# A bot takes over the seat of a leaving player, returns False if the
+	# game doesn't support that
+	def replace_player(self, player, bot):
+		return False
+
+
+	# Send the current public state to a spectator that joined mid-game
+	def spectator_joined(self, spectator):
+		pass
+
+
+	def stop(self):
+		pass
+
+
+	# Called after the cards module was reloaded, ids maps old card ids to
+	# the ids of the new card instances
+	def reload_cards(self, ids):
+		pass
+
+
+class Seat:
+	"""
+	Per player state of an Uno game. Cards are stored as ids (index in
+	ALL_CARDS).
+	"""
+	__slots__ = ("cards", "turn_over", "has_drawn_card")
+
+	def __init__(self, cards):
+		self.cards = cards
+		self.turn_over = True
+		self.has_drawn_card = False
+
+
+class Uno(Game):
+	LEFT  = 1
+	RIGHT = 2
+
+	name = "uno"
+	commands = {
+		"uno_play_card" : ("play_card", int),
+		"uno_draw_card" : ("draw_card", None),
+		"uno_sync" : ("sync", None)
+		}
+
+	# Overwritten by the server config, event logs of finished games are
+	# saved there
+	replay_directory = None
+
+	# No turn timer if turn_time is None
+	def __init__(self, lobby, turn_time=20.0, seed=None, debug=False):
+		super().__init__(lobby, debug=debug)
+
+		# All randomness comes from the seed so the game can be replayed
+		if seed == None:
+			seed = getrandbits(64)
+		self.random = SplitMix(seed)
+		self.log = EventLog(seed, lobby.player_count, game=self.name)
+
+		# Stacks and hands hold card ids
+		self._draw_card_stack = array("B")
+		# First card on the stack is never a special card
+		self.card_stack = array("B", [self.random.choice(REGULAR_CARDS).id])
+		self.direction = Uno.RIGHT
+		self.turn_time = turn_time
+
+		self.seats = {}
+		for player in lobby.players:
+			seat = Seat(array("B", self.random.sample(range(len(ALL_CARDS)), 7)))
+			self.seats[player] = seat
+			player.send(from_ids(seat.cards), "uno_give_card",
+				json_encoder=CardEncoder)
+
+		self.playing_player = lobby.players[0]
+		self.seats[self.playing_player].turn_over = False
+		
+		# Prevent race conditions if player draws or plays too quickly in
+		# succession
+		self.play_card_lock = Lock()
+		self.draw_card_lock = Lock()
+
+		self.turn_timer = None
+
+		# Send the first card on the stack to all players
+		self.broadcast(self.top_card, "uno_card_stack",
+			json_encoder=CardEncoder)
+		# Send whos turn it is to all players
+		self.broadcast(self.playing_player, "uno_turn",
+			json_encoder=UserEncoder)
+
+		self.reset_turn_timer()
+
+
+	def reset_turn_timer(self):
+		if self.turn_timer != None:
+			self.turn_timer.cancel()
+		if self.turn_time == None:
+			return
+
+		self.turn_timer = call_later(self.turn_time, self.turn_time_expired)
+
+
+	def turn_time_expired(self):
+		with event_lock:
+			# The game could have been stopped while waiting for the lock
+			if self.lobby.game is self:
+				self.log.record(TURN_EXPIRED,
+					self.lobby.players.index(self.playing_player))
+				self.end_turn(time_expired=True)
+
+
+	@property
+	def top_card(self):
+		return ALL_CARDS[self.card_stack[-1]]
+
+
+	@property
+	def draw_card_stack(self):
+		# Introduce a bit of randomness (does not respect card frequency)
+		while len(self._draw_card_stack) < 30:
+			self._draw_card_stack.append(self.random.choice(ALL_CARDS).id)
+		return self._draw_card_stack
+
+
+	def draw_card_from_stack(self):
+		# Fetch from property to keep the stack filled
+		card = self.draw_card_stack[0]
+		# Delete reference from stack list
+		del self._draw_card_stack[0]
+		return card
+
+
+	# For random cards
+	def give_cards(self, count, player):
+		cards = []
+		for i in range(count):
+			cards.append(self.draw_card_from_stack())
+		# Save cards to player deck server-side
+		self.seats[player].cards.extend(cards)
+		# Send client cards
+		player.send(from_ids(cards), "uno_give_card", json_encoder=CardEncoder)
+
+
+	# For specific cards (cheating mainly)
+	def give_card(self, face, color, player):
+		for card in ALL_CARDS:
+			if card.face == face and card.color == color:
+				self.log.record(GIVE_CARD, self.lobby.players.index(player),
+					card.id)
+				# Save card to player deck server-side
+				self.seats[player].cards.append(card.id)
+				# Send the card to client
+				player.send([card], "uno_give_card", 
+					json_encoder=CardEncoder)
+				return True
+		return False
+
+
+	# Effect of a played card
+	def apply_card(self, card, seat):
+		# Change direction
+		if card.face == ROTATE:
+			# Only two players -> Next turn name player
+			if len(self.lobby.players) != 2:
+				self.change_direction()
+				self.end_turn()
+			# Turn goes on if only two players are playing
+			# Player can draw another card if needed
+			else:
+				seat.has_drawn_card = False		
+			
+
+		# Skip player
+		elif card.face == BLOCK:
+			if len(self.lobby.players) != 2:
+				self.end_turn(player_inc=2)
+			# Turn goes on if only two players are playing
+			# Player can draw another card if needed
+			else:
+				seat.has_drawn_card = False
+
+		# Take two cards
+		elif card.face == TAKE_TWO:
+			self.give_cards(2, self.next_player)
+			self.end_turn()
+
+
+		# Take four cards
+		elif card.face == TAKE_FOUR:
+			self.give_cards(4, self.next_player)
+			# Turn does not end
+
+		# End turn only if the card does not require another card
+		elif card.face != PICK_COLOR:
+			self.end_turn()
+
+
+	# Row of PLAYABLE for the top card, variants with other rules override
+	# this
+	def playable_cards(self):
+		return PLAYABLE[self.card_stack[-1]]
+
+
+	def change_direction(self):
+		if self.direction == Uno.LEFT:
+			self.direction = Uno.RIGHT
+		elif self.direction == Uno.RIGHT:
+			self.direction = Uno.LEFT
+		else:
+			# Unexpected direction -> Direction is right
+			self.direction = Uno.RIGHT
+		self.broadcast(self.direction, "uno_direction")
+
+		if self.debug:
+			logging.info("Direction changed to '%s'" % 
+				("left" if self.direction == Uno.LEFT else "right"))
+
+
+	def get_next_player(self, player_inc=1):
+		players = self.lobby.players
+		player_index = players.index(self.playing_player)
+
+		if self.direction == Uno.LEFT:
+			next_player_overflowing_index = player_index - player_inc
+		elif self.direction == Uno.RIGHT:
+			next_player_overflowing_index = player_index + player_inc
+		else:
+			# Unexpected direction?
+			# Repeating turn
+			next_player_overflowing_index = player_index
+
+		return players[next_player_overflowing_index % len(players)]
+
+
+	@property
+	def next_player(self):
+		return self.get_next_player()
+
+
+	def end_turn(self, player_inc=1, time_expired=False):
+		next_player = self.get_next_player(player_inc)
+
+		if self.debug:
+			if time_expired:
+				logging.info("Turn time of '%i' expired" % self.turn_time)
+			logging.info("Next player: '%s'" % next_player)
+
+
+		seat = self.seats[self.playing_player]
+		seat.turn_over = True
+		seat.has_drawn_card = False
+		self.seats[next_player].turn_over = False
+
+		self.playing_player = next_player
+
+		self.reset_turn_timer()
+
+		self.broadcast(self.playing_player, "uno_turn",
+			json_encoder=UserEncoder)
+
+
+	def play_card(self, card_id, player):
+		self.play_card_lock.acquire()
+		# Out of range ids are invalid either way
+		self.log.record(PLAY_CARD, self.lobby.players.index(player),
+			card_id if card_id in range(0xFFFF) else 0xFFFF)
+
+		successful = False
+		# If it's the turn of the player who wants to play a card
+		if player == self.playing_player:
+			seat = self.seats[player]
+			# Is the card_id valid?
+			if card_id in range(len(seat.cards)):
+				# Acquire the card
+				card = ALL_CARDS[seat.cards[card_id]]
+
+				if self.debug:
+					logging.info("'%s' played: %s" % (player, card))
+					logging.info("Cards of '%s': %s" % (player,
+						from_ids(seat.cards)))
+
+				# Does the played card fit on top of the card stack?
+				if self.playable_cards()[card.id]:
+					self.card_stack.append(card.id)
+
+					# Send the played card to all players
+					self.broadcast(card, "uno_card_stack",
+						json_encoder=CardEncoder)
+
+					self.apply_card(card, seat)
+
+					# Remove the card from the players deck
+					del seat.cards[card_id]
+
+					self.broadcast({
+						"player" : player, 
+						"count" : len(seat.cards)
+						}, "uno_card_count", exclude=player,
+						json_encoder=UserEncoder)
+					successful = True
+				
+				else:
+					if self.debug:
+						logging.warning("Card does not fit on top of stack. "
+							"Is the client desynchronized? (player: '%s')" %
+							player)
+
+				# If player has no cards left
+				if len(seat.cards) == 0:
+					self.broadcast(player.name, "uno_win")
+					self.lobby.stop()
+
+		self.play_card_lock.release()			
+		player.send(successful, "uno_play_card")
+
+
+	def draw_card(self, player):
+		self.draw_card_lock.acquire()
+		self.log.record(DRAW_CARD, self.lobby.players.index(player))
+		successful = self.draw(player)
+		self.draw_card_lock.release()
+		player.send(successful, "uno_draw_card")
+
+
+	# Rules of drawing, returns whether the player could draw
+	def draw(self, player):
+		seat = self.seats.get(player)
+		# If it's the turn of player who wants to play a card and
+		# he hasn't drawn a card this turn yet and
+		# he has no card that fits the top of the stack
+		if player != self.playing_player or seat.has_drawn_card or \
+			can_play_ids(seat.cards, self.playable_cards()):
+			return False
+
+		# Give player 1 card
+		self.give_cards(1, player)
+		# Can he play now?
+		# No -> End turn
+		if not can_play_ids(seat.cards, self.playable_cards()):
+			self.end_turn()
+		# Yes -> Can't draw any more cards
+		else:
+			seat.has_drawn_card = True
+
+		if self.debug:
+			logging.info("Player '%s' drew card '%s'" % (player, 
+				ALL_CARDS[seat.cards[-1]]))
+		return True
+
+
+	# If client desynchonises -> Should never happen but ¯\_(ツ)_/¯
+	def sync(self, player):
+		player.send(from_ids(self.seats[player].cards), "uno_sync",
+			json_encoder=CardEncoder)
+
+
+	def stop(self):
+		if self.turn_timer != None:
+			self.turn_timer.cancel()
+
+		if self.replay_directory:
+			try:
+				path = self.log.save(self.replay_directory)
+			except IOError:
+				logging.error("Could not save replay log of '%s'" %
+					self.lobby)
+			else:
+				if self.debug:
+					logging.info("Replay log of '%s' saved to '%s'" % (
+						self.lobby, path))
+
+
+	def spectator_joined(self, spectator):
+		publish = self.lobby.spectators.publish
+		publish(self.top_card, "uno_card_stack", json_encoder=CardEncoder,
+			only=spectator)
+		publish(self.direction, "uno_direction", only=spectator)
+		for player, seat in self.seats.items():
+			publish({"player" : player, "count" : len(seat.cards)},
+				"uno_card_count", json_encoder=UserEncoder, only=spectator)
+		publish(self.playing_player, "uno_turn", json_encoder=UserEncoder,
+			only=spectator)
+
+
+	def player_leave(self, player):
+		self.log.record(LEAVE, self.lobby.players.index(player))
+		if player == self.playing_player:
+			self.end_turn(player_inc=1)
+		del self.seats[player]
+
+
+	def replace_player(self, player, bot):
+		self.log.record(TAKEOVER, self.lobby.players.index(player))
+		seat = self.seats.pop(player)
+		self.seats[bot] = seat
+		if self.playing_player == player:
+			self.playing_player = bot
+
+		# Same messages a client gets when the game starts
+		bot.send(from_ids(seat.cards), "uno_give_card", json_encoder=CardEncoder)
+		bot.send(self.playing_player, "uno_turn", json_encoder=UserEncoder)
+		return True
+
+
+	def reload_cards(self, ids):
+		# Cards that don't exist anymore keep their id
+		rebind = lambda stack: array("B", [ids.get(card_id, card_id)
+			for card_id in stack])
+
+		self.card_stack = rebind(self.card_stack)
+		self._draw_card_stack = rebind(self._draw_card_stack)
+		for seat in self.seats.values():
+			seat.cards = rebind(seat.cards)
+
+
+register_game(Uno)
+
+
+class Lobby:
+	# Overwritten by the server config
+	debug = False
+	game_debug = False
+	bot_takeover = False
+	default_game = "uno"
+
+	def __init__(self, name, host):
+		self.name = name
+		self.host = host
+
+		self.players = [host]
+		self.spectators = Audience()
+		self.chat = Chat()
+
+		self.playing = False
+
+		# Name in the game registry
+		self.game_name = self.default_game
+		self.game = None
+
+		# CPU time spent on messages of the players
+		self.messages = 0
+		self.cpu_time = 0.0
+
+		self.publish()
+
+		if self.debug:
+			logging.info("Lobby '%s' created by '%s'" % (self, self.host))
+
+
+	@property
+	def player_count(self):
+		return len(self.players)
+
+
+	@property
+	def human_count(self):
+		return sum(not player.bot for player in self.players)
+
+
+	# Keep the lobby list of the other workers up to date
+	def publish(self):
+		if cluster != None:
+			cluster.publish_lobby(self)
+
+
+	def join(self, player):
+		successful = False
+
+		if player not in self.players and not self.playing:
+			player.lobby = self
+			# Announce new player
+			broadcast(player.name, "lobby_user_join", self.players)
+			self.players.append(player)
+			self.publish()
+			# Players currently in lobby (including you)
+			player.send(self.players, "lobby_players",
+				json_encoder=UserEncoder)
+			# If host has changed since lobby_list
+			player.send(self.host.name, "lobby_host")
+			self.chat.send_history(player)
+			successful = True
+
+			if self.debug:
+				logging.info("Player '%s' joined lobby '%s'" % (player, 
+					self))
+
+		player.send(successful, "lobby_join")
+
+
+	def leave(self, player):
+		successful = False
+
+		if player in self.players:
+			# Seat of a player leaving a running game goes to a bot as long as
+			# other humans are still playing
+			bot = None
+			if self.playing and self.bot_takeover and not player.bot and \
+				self.human_count > 1:
+				bot = create_bot()
+
+			# If game is currently being played
+			if self.playing:
+				# Just to be sure
+				if self.game != None:
+					# Invoke player leave hook *before* removing player from 
+					# self.players
+					if bot != None and not self.game.replace_player(player, bot):
+						release_name(bot.name)
+						bot = None
+					if bot == None:
+						self.game.player_leave(player)
+
+
+			# Leave doesn't block, this could kick an unrelated player by
+			# accident
+			player_index = self.players.index(player)
+			player.lobby = None
+			
+
+			if bot != None:
+				bot.lobby = self
+				self.players[player_index] = bot
+			else:
+				del self.players[player_index]
+			# Broadcast that a player has left
+			broadcast(player_index, "lobby_user_leave", self.players)
+			if bot != None:
+				broadcast(bot.name, "lobby_user_join", self.players)
+
+				if self.debug:
+					logging.info("'%s' took over the seat of '%s'" % (bot,
+						player))
+
+			# Bots only exist while they are seated
+			if player.bot:
+				release_name(player.name)
+			
+			successful = True
+
+
+
+			if self.playing:
+				# Game stops when all but 1 player leaves
+				if self.player_count <= 1:
+					lobbies[self.name].stop()
+
+					if self.debug:
+						logging.info("Too few players in '%s'. Stopping game..." % 
+							self)
+
+			# No humans left in lobby -> delete Lobby
+			if self.human_count == 0:
+				lobbies[self.name].stop()
+				release_lobby(self.name)
+
+				for bot_ in self.players:
+					bot_.lobby = None
+					release_name(bot_.name)
+				self.players = []
+
+				for spectator in self.spectators.clear():
+					spectator.spectating = None
+					spectator.send(True, "lobby_spectate_leave")
+				lobby_deleted = True
+
+				if self.debug:
+					logging.info("Lobby '%s' is empty. Deleting..." % 
+						self)
+
+			# Still players left
+			# Host left -> Random player becomes host
+			elif player == self.host:
+				self.host = choice([user for user in self.players
+					if not user.bot])
+				broadcast(self.host.name, "lobby_host", self.players)
+
+				if self.debug:
+					logging.info("Lobby '%s' has new host '%s'" % (self, 
+						self.host))
+
+			if self.player_count > 0:
+				self.publish()
+
+
+			if self.debug:
+				logging.info("Player '%s' left lobby '%s'" % (player, 
+					self))
+
+		player.send(successful, "lobby_leave")
+
+
+	# Fills an empty seat
+	def add_bot(self, player):
+		successful = False
+		if player == self.host and not self.playing:
+			self.join(create_bot())
+			successful = True
+		player.send(successful, "lobby_add_bot")
+
+
+	def spectate(self, user):
+		successful = user not in self.players and user not in self.spectators
+		# Reply first, once added the fan-out thread writes to the socket too
+		user.send(successful, "lobby_spectate")
+
+		if successful:
+			user.spectating = self
+			self.spectators.add(user)
+			if self.game != None:
+				self.game.spectator_joined(user)
+
+			if self.debug:
+				logging.info("'%s' spectates lobby '%s' (%d spectators)" % (
+					user, self, len(self.spectators)))
+
+
+	def stop_spectating(self, user):
+		successful = self.spectators.remove(user)
+		if successful:
+			user.spectating = None
+		user.send(successful, "lobby_spectate_leave")
+
+
+	def kick(self, player_to_be_kicked, issuing_player):
+		successful = False
+		if issuing_player == self.host:
+			for player in self.players:
+				if player.name == player_to_be_kicked:
+					self.leave(player)
+					successful = True
+					break
+		issuing_player.send(successful, "lobby_kick")
+
+
+
+	def start(self, player):
+		successful = False
+		if player == self.host and not self.playing and self.player_count >= 2:
+			self.playing = True
+			broadcast(True, "lobby_playing", self.players)
+			self.spectators.publish(True, "lobby_playing")
+			self.game = games[self.game_name](self, debug=self.game_debug)
+			self.publish()
+			successful = True
+
+			if self.debug:
+				logging.info("Game '%s' started in lobby '%s'" % (self.game, 
+					self))
+
+		player.send(successful, "lobby_start")
+
+
+	def select_game(self, game_name, player):
+		successful = False
+		if player == self.host and not self.playing and game_name in games:
+			self.game_name = game_name
+			self.publish()
+			successful = True
+		player.send(successful, "lobby_game")
+
+
+	def stop(self, player=None):
+		if player != None:
+			successful = False
+			if player == self.host and self.playing:
+				self._stop()
+				successful = True
+			player.send(successful, "lobby_stop")
+		else:
+			self._stop()
+
+
+	def _stop(self):
+		if self.playing:
+			self.playing = False
+			# "Deallocation", the game owns all per player state
+			self.game.stop()
+			self.game = None
+			self.publish()
+			broadcast(False, "lobby_playing", self.players)
+			self.spectators.publish(False, "lobby_playing")
+
+			if self.debug:
+				logging.info("Lobby '%s' stopped" % self)
+
+
+	def chat_message_received(self, message, player):
+		successful = True
+		# Commands are rare, regular messages only pay for this check
+		if message[:1] == "/":
+			name, _, arguments = message.partition(" ")
+			command = COMMANDS.get(name)
+			if command != None:
+				player.send(command(self, player, arguments), "lobby_chat")
+				return
+
+		if self.chat.add(player, message):
+			call_later(WINDOW, self.flush_chat)
+
+		# Nothing can go wrong (yet)
+		player.send(successful, "lobby_chat")
+
+
+	def flush_chat(self):
+		with event_lock:
+			self.chat.flush(self.players)
+
+
+	def __eq__(self, other):
+		return type(other) is Lobby and other.name == self.name
+
+
+	def __str__(self):
+		return self.name
+
+
+class User(Server):
+	bot = False
+
+	def __init__(self, sock, routes, debug=False):
+		super().__init__(sock, routes, debug=debug)
+
+		self.name = None
+		self.lobby = None
+		# Lobby watched as a spectator
+		self.spectating = None
+		# Matchmaking queue waited in
+		self.matchmaking = None
+		self.wins = 0
+		# Logged in with the admin token
+		self.admin = False
+		# Set once spectating, all writes are non-blocking from then on
+		self.outbox = None
+		# Bytes of self.buf being processed, what follows was pipelined by
+		# the client (prefork hand over)
+		self.processing = 0
+
+		# Serialize incoming messages with all other lobby events
+		self.received_message = self.locked_received_message
+
+
+	def process(self, data):
+		self.processing = len(data)
+		return super().process(data)
+
+
+	def locked_received_message(self, message):
+		with event_lock:
+			lobby = self.lobby
+			start = thread_time()
+			self._received_message(message)
+			# Joining a lobby counts for that lobby
+			account(self, lobby or self.lobby, message, thread_time() - start)
+
+
+	def _write(self, data):
+		if self.outbox == None:
+			super()._write(data)
+			return
+		if self.terminated or self.sock is None:
+			raise RuntimeError("Cannot send on a terminated websocket")
+		self.outbox.write(data)
+
+
+	@property
+	def logged_in(self):
+		return self.name != None
+
+
+	def in_game(self, game):
+		if self.lobby != None:
+			# Variants count as the game they're based on
+			return isinstance(self.lobby.game, game)
+		return False
+
+
+	def closed(self, code, reason):
+		with event_lock:
+			# Leave the lobby
+			if self.lobby != None:
+				self.lobby.leave(self)
+			if self.spectating != None:
+				self.spectating.spectators.remove(self)
+			if self.matchmaking != None:
+				self.matchmaking.remove(self)
+			# Free up taken user name
+			if self.name != None:
+				release_name(self.name)
+
+		if type(reason) is bytes:
+			reason = reason.decode()
+
+		if self.logged_in:
+			logging.info("User '%s' disconnected ('%s': %d)" % (self.name,
+				reason, code))
+		else:
+			logging.info("Unauthenticated user disconnected. ('%s': '%d')" % (
+				reason, code))
+
+
+	def __str__(self):
+		return self.name if self.name else ""
+
+
+class LocalUser(User):
+	"""
+	User without a connection (replays, benchmarks). Everything sent to it
+	is dropped.
+	"""
+	# Knows no optional routes
+	peer_reverse_exchange_routes = {}
+
+	def __init__(self, name):
+		self.name = name
+		self.lobby = None
+		self.spectating = None
+		self.matchmaking = None
+		self.wins = 0
+		self.admin = False
+		self.outbox = None
+
+
+	def send(self, data, route, indexed_dict=False, json_encoder=None):
+		pass
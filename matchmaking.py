@@ -0,0 +1,131 @@
+"""
+Matchmaking queue. Waiting players are grouped into new lobbies of `size`
+players and the game starts right away. Once the longest waiting player
+has waited `max_wait` seconds everybody waiting gets a game, free seats
+go to bots.
+
+In prefork mode every worker matches its own users.
+"""
+
+from collections import deque
+from itertools import count, islice
+from time import monotonic
+
+from highway import logging
+
+from lobby import lobbies, event_lock, claim_lobby, create_bot, Lobby
+from scheduler import call_later
+
+# Set by the server config
+size = 4
+max_wait = 10.0
+
+# Wait times of this many matched players are kept for the metrics
+WAIT_SAMPLES = 1000
+
+
+class Queue:
+	def __init__(self):
+		# User -> time of joining, dicts keep the insertion order so this is
+		# a FIFO queue with O(1) removal
+		self.waiting = {}
+		# Fires when the longest waiting player has waited max_wait
+		self.timer = None
+		self.lobby_numbers = count(1)
+
+		self.matched = 0
+		self.waits = deque(maxlen=WAIT_SAMPLES)
+
+
+	def __len__(self):
+		return len(self.waiting)
+
+
+	def __contains__(self, user):
+		return user in self.waiting
+
+
+	def add(self, user):
+		if user in self.waiting:
+			return False
+		self.waiting[user] = monotonic()
+		user.matchmaking = self
+		self.match()
+		return True
+
+
+	def remove(self, user):
+		if self.waiting.pop(user, None) == None:
+			return False
+		user.matchmaking = None
+		return True
+
+
+	def match(self):
+		while len(self.waiting) >= size:
+			self.create_match(size)
+
+		if self.waiting:
+			joined = next(iter(self.waiting.values()))
+			if monotonic() - joined >= max_wait:
+				self.create_match(len(self.waiting))
+			# Rescheduled once it fires
+			elif self.timer == None:
+				self.timer = call_later(joined + max_wait - monotonic(),
+					self.wait_expired)
+
+
+	def wait_expired(self):
+		with event_lock:
+			self.timer = None
+			self.match()
+
+
+	def create_match(self, player_count):
+		now = monotonic()
+		players = list(islice(self.waiting, player_count))
+		for player in players:
+			self.waits.append(now - self.waiting.pop(player))
+			player.matchmaking = None
+		self.matched += len(players)
+
+		name = "Match %d" % next(self.lobby_numbers)
+		while not claim_lobby(name):
+			name = "Match %d" % next(self.lobby_numbers)
+
+		# Same messages as creating and joining a lobby by hand
+		host = players[0]
+		lobby = Lobby(name, host)
+		lobbies[name] = lobby
+		host.lobby = lobby
+		for player in players:
+			player.send(name, "matchmake")
+		for player in players[1:]:
+			lobby.join(player)
+		while lobby.player_count < size:
+			lobby.join(create_bot())
+		lobby.start(host)
+
+		if Lobby.debug:
+			logging.info("Matched %d players into '%s' (longest wait %.1fs)" % (
+				len(players), lobby, self.waits[-len(players)]))
+
+
+	def metrics(self):
+		waits = sorted(self.waits)
+		percentile = lambda p: waits[int(p * (len(waits) - 1))] if waits \
+			else 0.0
+		# Over the last WAIT_SAMPLES matched players
+		return {
+			"waiting" : len(self.waiting),
+			"matched" : self.matched,
+			"medianWait" : percentile(0.5),
+			"p95Wait" : percentile(0.95),
+			"maxWait" : percentile(1.0),
+			# Of the players still waiting
+			"longestWait" : monotonic() - next(iter(self.waiting.values()))
+				if self.waiting else 0.0
+			}
+
+
+queue = Queue()
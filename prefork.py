@@ -0,0 +1,307 @@
+"""
+Prefork mode: the supervisor binds the listening socket once and forks
+config.workers worker processes that all accept on it. Every worker runs
+its own lobbies.
+
+User and lobby names live in a shared index (a multiprocessing manager) so
+names stay unique across workers and lobby_list shows every lobby. Joining
+a lobby of another worker hands the connection over to that worker: the
+socket is passed over a unix socket together with the user name, the
+route exchange map and any frames already read from it, no new handshake
+is needed.
+
+The supervisor restarts workers that crashed or stopped sending
+heartbeats and drops their names and lobbies from the index.
+"""
+
+from multiprocessing import get_context
+from tempfile import TemporaryDirectory
+from threading import Thread
+from os.path import join, exists
+from json import dumps, loads
+from base64 import b64encode, b64decode
+from signal import signal, default_int_handler, SIGTERM
+from types import SimpleNamespace
+from time import time, sleep
+from os import kill, unlink
+import socket
+
+from highway import logging, reverse_dict
+from highway.utils import capture_trace
+
+import lobby
+from lobby import taken_names, lobbies, event_lock
+
+HEALTH_CHECK_INTERVAL = 1.0
+HEARTBEAT_INTERVAL = 2.0
+# A worker whose lobby events are blocked for this long is restarted
+HEARTBEAT_TIMEOUT = 30.0
+# Workers that don't exit in time after SIGTERM are killed
+SHUTDOWN_TIMEOUT = 5.0
+
+MAX_HANDOFF_SIZE = 65536
+
+
+class Cluster:
+	def __init__(self, worker_id, index, directory, server):
+		self.worker_id = worker_id
+		self.names = index.names
+		self.lobbies = index.lobbies
+		self.heartbeats = index.heartbeats
+		self.directory = directory
+		self.server = server
+
+
+	def socket_path(self, worker_id):
+		return join(self.directory, "worker-%d.sock" % worker_id)
+
+
+	def start(self):
+		Thread(target=self.accept_handoffs, daemon=True).start()
+		Thread(target=self.send_heartbeats, daemon=True).start()
+
+
+	def send_heartbeats(self):
+		while True:
+			# Only beat if lobby events are still being processed
+			with event_lock:
+				pass
+			self.heartbeats[self.worker_id] = time()
+			sleep(HEARTBEAT_INTERVAL)
+
+
+	def claim_name(self, name):
+		return self.names.setdefault(name, self.worker_id) == self.worker_id
+
+
+	def release_name(self, name):
+		if self.names.get(name) == self.worker_id:
+			self.names.pop(name, None)
+
+
+	def claim_lobby(self, name):
+		entry = {"worker" : self.worker_id, "host" : None,
+			"playerCount" : 0, "playing" : False, "game" : None}
+		return self.lobbies.setdefault(name, entry)["worker"] == self.worker_id
+
+
+	def publish_lobby(self, lobby_):
+		self.lobbies[lobby_.name] = {
+			"worker" : self.worker_id,
+			"host" : lobby_.host.name,
+			"playerCount" : lobby_.player_count,
+			"playing" : lobby_.playing,
+			"game" : lobby_.game_name
+			}
+
+
+	def release_lobby(self, name):
+		self.lobbies.pop(name, None)
+
+
+	def remote_lobbies(self):
+		# Same format LobbyEncoder produces
+		return {name : {key : entry[key] for key in entry if key != "worker"}
+			for name, entry in self.lobbies.items()
+			if entry["worker"] != self.worker_id}
+
+
+	# route is lobby_join or lobby_spectate, what the user does on arrival
+	def hand_over(self, user, lobby_name, route="lobby_join"):
+		entry = self.lobbies.get(lobby_name)
+		if entry == None or entry["worker"] == self.worker_id:
+			return False
+
+		payload = dumps({
+			"name" : user.name,
+			"lobby" : lobby_name,
+			"route" : route,
+			"routes" : user.peer_exchange_routes,
+			# Frames the client sent after this one that were already read
+			# from the socket. ws4py only reads what the current frame
+			# needs, so this is usually empty and the rest moves with the
+			# socket.
+			"pending" : b64encode(user.buf[user.processing:]).decode()
+			}).encode()
+
+		try:
+			with socket.socket(socket.AF_UNIX) as connection:
+				connection.connect(self.socket_path(entry["worker"]))
+				socket.send_fds(connection, [payload], [user.sock.fileno()])
+		except OSError:
+			# The user stays on this worker
+			logging.warning("Worker %d is unreachable" % entry["worker"])
+			user.send(False, route)
+			return True
+
+		# The user is gone for this worker without being disconnected, the
+		# other worker took over the name in the index
+		self.server.manager.remove(user)
+		del taken_names[taken_names.index(user.name)]
+		user.sock.close()
+		return True
+
+
+	def accept_handoffs(self):
+		path = self.socket_path(self.worker_id)
+		# Left behind by a crashed predecessor
+		if exists(path):
+			unlink(path)
+
+		listener = socket.socket(socket.AF_UNIX)
+		listener.bind(path)
+		listener.listen()
+
+		while True:
+			connection, _ = listener.accept()
+			try:
+				with connection:
+					payload, fds, _, _ = socket.recv_fds(connection,
+						MAX_HANDOFF_SIZE, 1)
+				if fds:
+					self.adopt(loads(payload.decode()),
+						socket.socket(fileno=fds[0]))
+			except Exception:
+				capture_trace()
+
+
+	def adopt(self, data, sock):
+		app = self.server.application
+		user = app.handler_cls(sock, app.routes, app.debug)
+		# Client already knows the routes (every worker has the same route
+		# table), skip the meta exchange. manager.add() calls opened(), which
+		# would send the routes again.
+		user.opened = lambda: None
+		user.peer_exchange_routes = {int(key) : value
+			for key, value in data["routes"].items()}
+		user.peer_reverse_exchange_routes = reverse_dict(
+			user.peer_exchange_routes)
+		user.buf = b64decode(data["pending"])
+
+		with event_lock:
+			user.name = data["name"]
+			taken_names.append(user.name)
+			self.names[user.name] = self.worker_id
+
+			if data["lobby"] not in lobbies:
+				user.send(False, data["route"])
+			elif data["route"] == "lobby_spectate":
+				lobbies[data["lobby"]].spectate(user)
+			else:
+				lobbies[data["lobby"]].join(user)
+
+		# Pipelined frames go first, the manager only reads from the socket
+		while user.buf:
+			if not user.once():
+				user.terminate()
+				return
+		self.server.manager.add(user)
+
+
+	def forget_worker(self, worker_id):
+		for index in (self.names, self.lobbies):
+			for key, value in list(index.items()):
+				owner = value["worker"] if type(value) is dict else value
+				if owner == worker_id:
+					index.pop(key, None)
+		self.heartbeats.pop(worker_id, None)
+
+
+class Supervisor:
+	def __init__(self, server, config, serve):
+		self.server = server
+		self.config = config
+		# Called in every worker to run the server
+		self.serve = serve
+
+		self.context = get_context("fork")
+		self.workers = {}
+		self.started = {}
+		self.running = False
+
+
+	def spawn(self, worker_id):
+		process = self.context.Process(target=self.run_worker,
+			args=(worker_id,), name="worker-%d" % worker_id)
+		process.start()
+		self.workers[worker_id] = process
+		self.started[worker_id] = time()
+		logging.info("Worker %d started (pid %d)" % (worker_id, process.pid))
+
+
+	def run_worker(self, worker_id):
+		# Supervisor terminates workers with SIGTERM, shut down like on ^C
+		signal(SIGTERM, default_int_handler)
+
+		lobby.cluster = Cluster(worker_id, self.index, self.directory,
+			self.server)
+		lobby.cluster.start()
+		self.serve(self.server, self.config)
+
+
+	def check_health(self, cluster):
+		for worker_id, process in list(self.workers.items()):
+			if not process.is_alive():
+				logging.error("Worker %d exited with code %s, restarting" % (
+					worker_id, process.exitcode))
+				cluster.forget_worker(worker_id)
+				self.spawn(worker_id)
+				continue
+
+			last_beat = max(self.heartbeats.get(worker_id, 0),
+				self.started[worker_id])
+			if time() - last_beat > HEARTBEAT_TIMEOUT:
+				logging.error("Worker %d is unresponsive, killing it" %
+					worker_id)
+				process.kill()
+
+
+	def stop(self, signum=None, frame=None):
+		self.running = False
+
+
+	def forward_signal(self, signum, frame):
+		for process in self.workers.values():
+			if process.is_alive():
+				kill(process.pid, signum)
+
+
+	def run(self):
+		# Workers race for new connections, the losers must not block in
+		# accept()
+		self.server.socket.setblocking(False)
+
+		self.running = True
+		signal(SIGTERM, self.stop)
+		if self.config.hot_reload:
+			from signal import SIGHUP
+			signal(SIGHUP, self.forward_signal)
+
+		with TemporaryDirectory() as directory, \
+			self.context.Manager() as manager:
+
+			self.directory = directory
+			# Workers inherit the proxies
+			self.index = SimpleNamespace(names=manager.dict(),
+				lobbies=manager.dict(), heartbeats=manager.dict())
+			self.heartbeats = self.index.heartbeats
+			cluster = Cluster(None, self.index, directory, self.server)
+
+			try:
+				for worker_id in range(self.config.workers):
+					self.spawn(worker_id)
+				while self.running:
+					sleep(HEALTH_CHECK_INTERVAL)
+					if self.running:
+						self.check_health(cluster)
+			except KeyboardInterrupt:
+				pass
+			finally:
+				for process in self.workers.values():
+					process.terminate()
+				for process in self.workers.values():
+					process.join(SHUTDOWN_TIMEOUT)
+					if process.is_alive():
+						process.kill()
+						process.join()
+				self.server.server_close()
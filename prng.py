@@ -0,0 +1,46 @@
+"""
+Seeded random numbers for games (dealing and drawing cards), replays
+depend on the same seed giving the same cards.
+
+random.Random keeps about 2.5 KB of Mersenne Twister state, one per game
+costs more memory than the player state of the whole game. SplitMix keeps
+a single 64 bit integer, which is plenty for shuffling a few cards.
+"""
+
+MASK = (1 << 64) - 1
+
+
+class SplitMix:
+	"""
+	splitmix64 with the few helpers games need. Not for anything security
+	related.
+	"""
+	__slots__ = ("state",)
+
+	def __init__(self, seed):
+		self.state = seed & MASK
+
+
+	def next(self):
+		self.state = state = (self.state + 0x9E3779B97F4A7C15) & MASK
+		state = ((state ^ (state >> 30)) * 0xBF58476D1CE4E5B9) & MASK
+		state = ((state ^ (state >> 27)) * 0x94D049BB133111EB) & MASK
+		return state ^ (state >> 31)
+
+
+	# 0 <= n < limit, the bias is far below anything a game could notice
+	def below(self, limit):
+		return (self.next() * limit) >> 64
+
+
+	def choice(self, sequence):
+		return sequence[self.below(len(sequence))]
+
+
+	# count distinct elements in random order (partial Fisher-Yates)
+	def sample(self, population, count):
+		pool = list(population)
+		for index in range(count):
+			other = index + self.below(len(pool) - index)
+			pool[index], pool[other] = pool[other], pool[index]
+		return pool[:count]
@@ -0,0 +1,105 @@
+"""
+Profiling of the running server for the admin routes (see routes.py).
+
+The sampling profiler looks at the stacks of all threads a hundred times a
+second and returns them in the collapsed format flamegraph.pl and
+speedscope read ("thread;file:function;... count" per line). It's wall
+clock time, threads waiting for the event lock or a socket show up too.
+
+CPU time of every received message is accounted to its route and to the
+lobby of the user, always on. In prefork mode everything is per worker.
+"""
+
+from collections import Counter
+from threading import Thread, enumerate as threads
+from time import monotonic, sleep
+from os.path import basename
+from hmac import compare_digest
+import sys
+
+from highway import parse_metadata
+from highway.utils import capture_trace
+
+# Set by the server config, admin routes are disabled without a token
+admin_token = None
+
+SAMPLE_INTERVAL = 0.01
+MAX_PROFILE_TIME = 60.0
+
+# Route name -> [messages, cpu seconds]
+route_times = {}
+
+# Only one profiler runs at a time
+sampler = None
+
+
+def check_token(token):
+	return admin_token != None and type(token) is str and \
+		compare_digest(token.encode(), admin_token.encode())
+
+
+def account(user, lobby, message, cpu_time):
+	try:
+		_, route_id = parse_metadata(message.data)
+		route = user.exchange_routes.get(route_id)
+	except Exception:
+		route = None
+
+	times = route_times.get(route)
+	if times == None:
+		times = route_times[route] = [0, 0.0]
+	times[0] += 1
+	times[1] += cpu_time
+
+	if lobby != None:
+		lobby.messages += 1
+		lobby.cpu_time += cpu_time
+
+
+def collapse(thread_name, frame):
+	stack = []
+	while frame != None:
+		code = frame.f_code
+		stack.append("%s:%s" % (basename(code.co_filename), code.co_name))
+		frame = frame.f_back
+	stack.append(thread_name)
+	return ";".join(reversed(stack))
+
+
+class Sampler(Thread):
+	def __init__(self, duration, callback):
+		super().__init__(name="sampler")
+		self.daemon = True
+		self.duration = duration
+		# Called with the collapsed stacks once done, in the sampler thread
+		self.callback = callback
+
+
+	def run(self):
+		global sampler
+		stacks = Counter()
+		end = monotonic() + self.duration
+		try:
+			while monotonic() < end:
+				names = {thread.ident : thread.name for thread in threads()}
+				for ident, frame in sys._current_frames().items():
+					if ident != self.ident:
+						stacks[collapse(names.get(ident, str(ident)),
+							frame)] += 1
+				sleep(SAMPLE_INTERVAL)
+		finally:
+			sampler = None
+		try:
+			self.callback("".join("%s %d\n" % (stack, count)
+				for stack, count in stacks.items()))
+		except Exception:
+			capture_trace()
+
+
+def start_profile(duration, callback):
+	global sampler
+	if sampler != None or not 0 < duration <= MAX_PROFILE_TIME:
+		return False
+	sampler = Sampler(duration, callback)
+	sampler.start()
+	return True
@@ -0,0 +1,32 @@
+from threading import Thread
+from os import execv
+from sys import argv, executable
+
+from highway import logging
+from highway.utils import capture_trace
+
+
+class REPL(Thread):
+	def __init__(self, namespace, reload=None):
+		super().__init__()
+		self.daemon = True
+		# Globals the typed in code is executed in
+		self.namespace = namespace
+		self.reload = reload
+
+	def run(self):
+		logging.header("REPL started. Type in Python code to introspect. "
+			"(^D to %s)" % ("reload" if self.reload else "restart"))
+		while True:
+			try:
+				exec(input(""), self.namespace)
+			except Exception as e:
+				if type(e) is EOFError:
+					# Reloading keeps all sockets and games alive, restarting
+					# drops every connection
+					if self.reload:
+						self.reload()
+					else:
+						execv(executable, ["python3"] + argv)
+				else:
+					capture_trace()
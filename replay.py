@@ -0,0 +1,161 @@
+"""
+Binary event log of an Uno game and a tool to replay it without sockets.
+
+Every game has its own seeded RNG, so the seed and the sequence of player
+actions are enough to reproduce it exactly. Each event takes 5 bytes
+(event, player index, argument). The player index is the position in
+lobby.players at the time of the event.
+
+	python replay.py [-d] <file>
+"""
+
+from struct import Struct
+from os.path import join
+from time import time
+
+# Events
+PLAY_CARD 		= 	0
+DRAW_CARD 		= 	1
+TURN_EXPIRED 	= 	2
+LEAVE 			= 	3
+# Cheats (/debug)
+GIVE_CARD 		= 	4
+# A bot took over the seat
+TAKEOVER 		= 	5
+
+EVENT_NAMES = {PLAY_CARD : "play card", DRAW_CARD : "draw card",
+				TURN_EXPIRED : "turn expired", LEAVE : "leave",
+				GIVE_CARD : "give card", TAKEOVER : "takeover"}
+
+# Longest game name (UTF-8 encoded) the header can hold
+MAX_GAME_NAME = 16
+# Magic, seed, player count, game name (registry name, nul padded)
+HEADER = Struct("<4sQH%ds" % MAX_GAME_NAME)
+EVENT = Struct("<BHH")
+
+MAGIC = b"UNO2"
+
+
+class EventLog:
+	__slots__ = ("seed", "player_count", "events", "game")
+
+	def __init__(self, seed, player_count, events=None, game="uno"):
+		self.seed = seed
+		self.player_count = player_count
+		self.events = bytearray() if events == None else events
+		self.game = game
+
+
+	def record(self, event, player_index, argument=0):
+		self.events += EVENT.pack(event, player_index, argument)
+
+
+	def __iter__(self):
+		return EVENT.iter_unpack(self.events)
+
+
+	def __len__(self):
+		return len(self.events) // EVENT.size
+
+
+	def dumps(self):
+		return HEADER.pack(MAGIC, self.seed, self.player_count,
+			self.game.encode()) + self.events
+
+
+	@staticmethod
+	def loads(data):
+		magic, seed, player_count, game = HEADER.unpack_from(data)
+		if magic != MAGIC:
+			raise ValueError("not an uno replay log")
+		return EventLog(seed, player_count, bytearray(data[HEADER.size:]),
+			game.rstrip(b"\0").decode())
+
+
+	def save(self, directory):
+		path = join(directory, "%d-%016x.replay" % (time() * 1000,
+			self.seed))
+		with open(path, "wb") as file:
+			file.write(self.dumps())
+		return path
+
+
+	@staticmethod
+	def load(path):
+		with open(path, "rb") as file:
+			return EventLog.loads(file.read())
+
+
+def replay(log, debug=False):
+	"""
+	Re-executes a log against the game engine and returns the game.
+	Turn timers are disabled, expired turns come from the log.
+	"""
+	from lobby import lobbies, games, Lobby, LocalUser
+	from cards import ALL_CARDS
+	# Registers the variants
+	import variants
+
+	players = [LocalUser("player%d" % index)
+		for index in range(log.player_count)]
+	lobby = Lobby("replay", players[0])
+	lobbies[lobby.name] = lobby
+	players[0].lobby = lobby
+	for player in players[1:]:
+		lobby.join(player)
+
+	lobby.playing = True
+	lobby.game = game = games[log.game](lobby, turn_time=None,
+		seed=log.seed, debug=debug)
+
+	for event, player_index, argument in log:
+		# Game has ended
+		if lobby.game is not game:
+			break
+
+		player = lobby.players[player_index]
+		if event == PLAY_CARD:
+			game.play_card(argument, player)
+		elif event == DRAW_CARD:
+			game.draw_card(player)
+		elif event == TURN_EXPIRED:
+			game.turn_time_expired()
+		elif event == LEAVE:
+			lobby.leave(player)
+		elif event == GIVE_CARD:
+			card = ALL_CARDS[argument]
+			game.give_card(card.face, card.color, player)
+		elif event == TAKEOVER:
+			# Moves of the bot are in the log as well
+			bot = LocalUser("bot%d" % player_index)
+			game.replace_player(player, bot)
+			bot.lobby = lobby
+			lobby.players[player_index] = bot
+	return game
+
+
+if __name__ == "__main__":
+	from optparse import OptionParser
+	from time import perf_counter
+
+	parser = OptionParser(usage="%prog [options] file")
+	parser.add_option("-d", "--debug", action="store_true", dest="debug",
+		default=False)
+	options, args = parser.parse_args()
+	if len(args) != 1:
+		parser.error("no replay log given")
+
+	# Keep the engine import out of the measurement
+	import lobby
+
+	log = EventLog.load(args[0])
+	start = perf_counter()
+	game = replay(log, debug=options.debug)
+	elapsed = perf_counter() - start
+
+	print("Replayed %d events (%s, seed %016x) in %.2f ms" % (len(log),
+		log.game, log.seed, elapsed * 1000))
+	print("Game %s, top card: %s" % ("running" if game.lobby.game is game
+		else "finished", game.top_card))
+	for player, seat in game.seats.items():
+		print("%s: %d cards" % (player, len(seat.cards)))
@@ -0,0 +1,289 @@
+from highway import Route
+
+from lobby import lobbies
+from lobby import claim_name, claim_lobby, list_lobbies, join_remote_lobby
+from lobby import spectate_remote_lobby
+from lobby import LobbyEncoder, Lobby, game_routes, event_lock
+from scheduler import call_later
+
+import matchmaking
+import profiling
+
+
+class Login(Route):
+	def run(self, data, handler):
+		successful = False
+		if type(data) is str:
+			if claim_name(data):
+				handler.name = data
+
+				successful = True
+		handler.send(successful, "login")
+
+
+class LobbyList(Route):
+	def run(self, data, handler):
+		handler.send(list_lobbies(), "lobby_list", json_encoder=LobbyEncoder)
+
+
+class LobbyCreate(Route):
+	def run(self, data, handler):
+		successful = False
+		if handler.logged_in:
+			if type(data) is str and len(data) > 0:
+				# If already in a lobby leave
+				if handler.lobby:
+					handler.lobby.leave(handler)
+					handler.lobby = None
+				# Players can't spectate
+				if handler.spectating:
+					handler.spectating.stop_spectating(handler)
+				# Or wait for a match
+				if handler.matchmaking:
+					handler.matchmaking.remove(handler)
+				# If lobby name not taken
+				if claim_lobby(data):
+					lobby = Lobby(data, handler)
+
+					lobbies[data] = lobby
+					handler.lobby = lobby
+
+					successful = True
+		handler.send(successful, "lobby_create")
+
+"""
+All routes that wrap an instance method only implement
+parameter and state checking. Logic specific to the class is
+always handled in the class. This includes reporting errors
+to the user and state corrections.
+
+Linear state progression (A -> B -> C) is preferred, only the last
+state has to to be checked this way. Every state should have a
+default value indicating that it has not been reached. If that's
+impossible for some good reason the use of helper functions is
+encouraged.
+
+If a certain function sigature is required the data is validated
+before executing *any* further logic. (Variable definitions are allowed)
+The first line in routes that return success or failure is always the
+definiton of *successful* with an appropriate default value.
+If failure is the only possible outcome outside of the instance method call,
+successful should not be defined and return statements must be used to
+speed up cancellation.
+"""
+
+class LobbyJoin(Route):
+	def run(self, data, handler):
+		successful = True
+		if type(data) is str:
+			if handler.logged_in:
+				if handler.lobby != None or handler.spectating != None or \
+					handler.matchmaking != None:
+					successful = False
+				elif data in lobbies:
+					lobbies[data].join(handler)
+				# No worker has that lobby
+				elif not join_remote_lobby(data, handler):
+					successful = False
+		if not successful:
+			handler.send(successful, "lobby_join")
+
+
+
+class LobbySpectate(Route):
+	def run(self, data, handler):
+		if type(data) is str:
+			if handler.logged_in and handler.lobby == None and \
+				handler.spectating == None and handler.matchmaking == None:
+				if data in lobbies:
+					lobbies[data].spectate(handler)
+					return
+				# Lobby of another worker in prefork mode
+				if spectate_remote_lobby(data, handler):
+					return
+		handler.send(False, "lobby_spectate")
+
+
+class LobbySpectateLeave(Route):
+	def run(self, data, handler):
+		if handler.spectating:
+			handler.spectating.stop_spectating(handler)
+			return
+		handler.send(False, "lobby_spectate_leave")
+
+
+class Matchmake(Route):
+	def run(self, data, handler):
+		successful = False
+		if handler.logged_in and handler.lobby == None and \
+			handler.spectating == None and handler.matchmaking == None:
+			successful = True
+		# Reply first, a match could be found right away
+		handler.send(successful, "matchmake")
+		if successful:
+			matchmaking.queue.add(handler)
+
+
+class MatchmakeLeave(Route):
+	def run(self, data, handler):
+		if handler.matchmaking:
+			handler.send(handler.matchmaking.remove(handler), "matchmake_leave")
+			return
+		handler.send(False, "matchmake_leave")
+
+
+class MatchmakeStats(Route):
+	def run(self, data, handler):
+		handler.send(matchmaking.queue.metrics(), "matchmake_stats")
+
+
+class LobbyLeave(Route):
+	def run(self, data, handler):
+		if handler.lobby:
+			handler.lobby.leave(handler)
+			return
+		handler.send(False, "lobby_leave")
+
+
+class LobbyStart(Route):
+	def run(self, data, handler):
+		if handler.lobby:
+			handler.lobby.start(handler)
+			return
+		handler.send(False, "lobby_start")
+
+
+class LobbyAddBot(Route):
+	def run(self, data, handler):
+		if handler.lobby:
+			handler.lobby.add_bot(handler)
+			return
+		handler.send(False, "lobby_add_bot")
+
+
+class LobbyGame(Route):
+	def run(self, data, handler):
+		if type(data) is str:
+			if handler.lobby:
+				handler.lobby.select_game(data, handler)
+				return
+		handler.send(False, "lobby_game")
+
+
+class LobbyKick(Route):
+	def run(self, data, handler):
+		if type(data) is str:
+			if handler.lobby:
+				handler.lobby.kick(data, handler)
+				return
+		handler.send(False, "lobby_kick")
+
+
+class LobbyChat(Route):
+	def run(self, data, handler):
+		if type(data) is str:
+			if handler.lobby:
+				handler.lobby.chat_message_received(data, handler)
+				return
+		handler.send(False, "lobby_chat")
+
+
+class GameCommand(Route):
+	"""
+	Forwards a game route to the command table of the game being played
+	(Game.commands), one lookup per message.
+	"""
+	def __init__(self, route):
+		self.route = route
+
+
+	# Runs for every game message, identity checks only
+	def run(self, data, handler):
+		lobby = handler.lobby
+		game = lobby.game if lobby is not None else None
+		command = game.dispatch.get(self.route) if game is not None else None
+		if command is not None:
+			method, data_type = command
+			if data_type is None:
+				method(handler)
+				return
+			if type(data) is data_type:
+				method(data, handler)
+				return
+		handler.send(False, self.route)
+
+
+class AdminLogin(Route):
+	def run(self, data, handler):
+		successful = False
+		if profiling.check_token(data):
+			handler.admin = True
+			successful = True
+		handler.send(successful, "admin_login")
+
+
+# Replies right away, the collapsed stacks follow on the same route once
+# the profile is done
+class AdminProfile(Route):
+	def run(self, data, handler):
+		successful = False
+		if handler.admin and type(data) in (int, float):
+			# Sampler thread hands the result to the scheduler, sends to a
+			# user only happen under the event lock
+			successful = profiling.start_profile(data, lambda stacks:
+				call_later(0, self.send_profile, stacks, handler))
+		handler.send(successful, "admin_profile")
+
+
+	@staticmethod
+	def send_profile(stacks, handler):
+		with event_lock:
+			# Admin could have disconnected
+			if not handler.terminated:
+				handler.send(stacks, "admin_profile")
+
+
+class AdminCpu(Route):
+	def run(self, data, handler):
+		if not handler.admin:
+			handler.send(False, "admin_cpu")
+			return
+
+		# Hottest lobbies first
+		hot_lobbies = sorted(lobbies.values(),
+			key=lambda lobby: lobby.cpu_time, reverse=True)[:20]
+		handler.send({
+			"routes" : {str(route) : {"messages" : messages, "cpuTime" : time}
+				for route, (messages, time) in profiling.route_times.items()},
+			"lobbies" : {lobby.name : {"messages" : lobby.messages,
+				"cpuTime" : lobby.cpu_time} for lobby in hot_lobbies}
+			}, "admin_cpu")
+
+
+# Route instances are stateless and can be swapped out while handlers are
+# connected as long as the route names stay the same
+def create_routes():
+	routes = {
+		"login" : Login(),
+		"lobby_list" : LobbyList(),
+		"lobby_create" : LobbyCreate(),
+		"lobby_join" : LobbyJoin(),
+		"lobby_start" : LobbyStart(),
+		"lobby_leave" : LobbyLeave(),
+		"lobby_kick" : LobbyKick(),
+		"lobby_add_bot" : LobbyAddBot(),
+		"lobby_game" : LobbyGame(),
+		"lobby_chat" : LobbyChat(),
+		"lobby_spectate" : LobbySpectate(),
+		"lobby_spectate_leave" : LobbySpectateLeave(),
+		"matchmake" : Matchmake(),
+		"matchmake_leave" : MatchmakeLeave(),
+		"matchmake_stats" : MatchmakeStats(),
+		"admin_login" : AdminLogin(),
+		"admin_profile" : AdminProfile(),
+		"admin_cpu" : AdminCpu()
+	}
+	# Routes of the registered games, new games need no routes of their own
+	for route in game_routes():
+		routes[route] = GameCommand(route)
+	return routes
@@ -0,0 +1,119 @@
+"""
+Single thread running delayed callbacks (turn timers, bot moves), so the
+number of threads doesn't grow with the number of games or bots.
+"""
+
+from heapq import heappush, heappop, heapify
+from threading import Thread, Condition
+from itertools import count
+from time import monotonic
+
+from highway.utils import capture_trace
+
+# Cancelled tasks stay in the heap until they are due (every turn cancels
+# a timer). The heap is rebuilt without them once there are this many and
+# they make up more than half of it.
+COMPACT_THRESHOLD = 1024
+
+
+class Task:
+	__slots__ = ("due", "callback", "args", "cancelled", "scheduler")
+
+	def __init__(self, due, callback, args, scheduler):
+		self.due = due
+		self.callback = callback
+		self.args = args
+		self.cancelled = False
+		# None once the task left the heap
+		self.scheduler = scheduler
+
+
+	# Same interface as threading.Timer
+	def cancel(self):
+		scheduler = self.scheduler
+		if scheduler != None:
+			scheduler.cancel(self)
+		else:
+			self.cancelled = True
+
+
+class Scheduler(Thread):
+	def __init__(self):
+		super().__init__(name="scheduler")
+		self.daemon = True
+
+		# (due, sequence, task), sequence keeps equal due times in order
+		self.heap = []
+		self.sequence = count()
+		self.condition = Condition()
+		# Cancelled tasks still in the heap
+		self.cancelled = 0
+
+
+	def call_later(self, delay, callback, *args):
+		task = Task(monotonic() + delay, callback, args, self)
+		with self.condition:
+			heappush(self.heap, (task.due, next(self.sequence), task))
+			# Only wake up if the new task is the next one due
+			if self.heap[0][2] is task:
+				self.condition.notify()
+		return task
+
+
+	def cancel(self, task):
+		with self.condition:
+			if task.cancelled:
+				return
+			task.cancelled = True
+			# Already taken out of the heap
+			if task.scheduler == None:
+				return
+
+			self.cancelled += 1
+			if self.cancelled >= COMPACT_THRESHOLD and \
+				self.cancelled * 2 > len(self.heap):
+				for _, _, cancelled in self.heap:
+					if cancelled.cancelled:
+						cancelled.scheduler = None
+				self.heap = [entry for entry in self.heap
+					if not entry[2].cancelled]
+				heapify(self.heap)
+				self.cancelled = 0
+
+
+	# Returns the next due task that is not cancelled
+	def next_task(self):
+		with self.condition:
+			while True:
+				if self.heap:
+					timeout = self.heap[0][0] - monotonic()
+					if timeout <= 0:
+						task = heappop(self.heap)[2]
+						task.scheduler = None
+						if not task.cancelled:
+							return task
+						self.cancelled -= 1
+						continue
+				else:
+					timeout = None
+				self.condition.wait(timeout)
+
+
+	def run(self):
+		while True:
+			task = self.next_task()
+			try:
+				task.callback(*task.args)
+			except Exception:
+				capture_trace()
+
+
+scheduler = None
+
+
+def call_later(delay, callback, *args):
+	global scheduler
+	if scheduler == None:
+		scheduler = Scheduler()
+		scheduler.start()
+	return scheduler.call_later(delay, callback, *args)
@@ -0,0 +1,252 @@
+"""
+Read-only fan-out of public game events to spectators.
+
+Games only append events to a queue, encoding and sending happens on the
+fan-out thread. Every event is encoded once per exchange route id (all
+official clients share one) no matter how many spectators watch. With a
+delay configured, events are held back for that many seconds (to keep
+spectators from relaying information to players).
+
+Writes to spectator sockets never block (see Outbox). What a socket can't
+take right away is queued and retried, spectators falling more than
+MAX_BACKLOG bytes behind are disconnected. One slow viewer never holds up
+the other audiences or the lobby events.
+
+In prefork mode a spectator of a lobby on another worker is handed over
+to that worker like a joining player.
+"""
+
+from collections import deque
+from threading import Thread, Condition, Lock
+from time import monotonic
+from socket import MSG_DONTWAIT, SHUT_RDWR
+
+from highway import pack_message
+from highway.utils import capture_trace
+
+# Set by the server config
+delay = 0.0
+
+# Started with the first spectator
+fan_out = None
+
+# Unsent bytes a spectator may have queued before being disconnected
+MAX_BACKLOG = 1 << 20
+# Seconds between write retries to backed up spectators
+RETRY_INTERVAL = 0.05
+
+
+class Outbox:
+	"""
+	Non-blocking writes to the socket of a spectator, used for every frame
+	sent to it (User._write) so frames of different threads never
+	interleave.
+	"""
+	def __init__(self, sock):
+		self.sock = sock
+		self.queue = deque()
+		self.size = 0
+		self.dropped = False
+		# Only held for non-blocking sends
+		self.lock = Lock()
+
+
+	def write(self, data):
+		with self.lock:
+			if self.dropped:
+				return
+			self.queue.append(data)
+			self.size += len(data)
+			self._flush()
+			backed_up = self.size > 0
+		if backed_up:
+			fan_out.retry(self)
+
+
+	# Returns True once everything is written (or the spectator is dropped)
+	def flush(self):
+		with self.lock:
+			if not self.dropped:
+				self._flush()
+			return self.size == 0
+
+
+	def _flush(self):
+		try:
+			while self.queue:
+				data = self.queue[0]
+				sent = self.sock.send(data, MSG_DONTWAIT)
+				self.size -= sent
+				if sent < len(data):
+					self.queue[0] = data[sent:]
+					break
+				self.queue.popleft()
+		except BlockingIOError:
+			pass
+		except OSError:
+			self.drop()
+			return
+
+		if self.size > MAX_BACKLOG:
+			self.drop()
+
+
+	def drop(self):
+		self.dropped = True
+		self.queue.clear()
+		self.size = 0
+		# The manager thread sees the connection end and runs the usual
+		# User.closed() cleanup
+		try:
+			self.sock.shutdown(SHUT_RDWR)
+		except OSError:
+			pass
+
+
+class FanOut(Thread):
+	def __init__(self, delay=0.0):
+		super().__init__(name="spectator-fan-out")
+		self.daemon = True
+		self.delay = delay
+
+		self.queue = deque()
+		self.condition = Condition()
+		# Outboxes with queued data
+		self.backed_up = set()
+
+
+	def publish(self, audience, data, route, json_encoder=None, only=None):
+		# Delay is constant, so the queue stays ordered by due time
+		published = monotonic()
+		event = (published + self.delay, published, audience, data, route,
+			json_encoder, only)
+		with self.condition:
+			self.queue.append(event)
+			self.condition.notify()
+
+
+	def retry(self, outbox):
+		with self.condition:
+			if not outbox in self.backed_up:
+				self.backed_up.add(outbox)
+				self.condition.notify()
+
+
+	def next_batch(self):
+		with self.condition:
+			while True:
+				if self.queue:
+					timeout = self.queue[0][0] - monotonic()
+					if timeout <= 0:
+						break
+				else:
+					timeout = None
+				if self.backed_up:
+					if timeout == None or timeout > RETRY_INTERVAL:
+						timeout = RETRY_INTERVAL
+					# Time to retry the backed up spectators
+					if not self.condition.wait(timeout):
+						return []
+				else:
+					self.condition.wait(timeout)
+
+			now = monotonic()
+			batch = []
+			while self.queue and self.queue[0][0] <= now:
+				batch.append(self.queue.popleft())
+			return batch
+
+
+	def run(self):
+		while True:
+			for _, published, audience, data, route, json_encoder, only in \
+				self.next_batch():
+				try:
+					audience.deliver(published, data, route, json_encoder,
+						only)
+				except Exception:
+					capture_trace()
+
+			with self.condition:
+				backed_up = list(self.backed_up)
+			for outbox in backed_up:
+				if outbox.flush():
+					with self.condition:
+						self.backed_up.discard(outbox)
+
+
+class Audience:
+	"""
+	Spectators of a single lobby.
+	"""
+	def __init__(self):
+		# Spectator -> time of joining, events published before that are
+		# not delivered to them
+		self.spectators = {}
+		# Never held while sending
+		self.lock = Lock()
+
+
+	def __len__(self):
+		return len(self.spectators)
+
+
+	def __contains__(self, user):
+		return user in self.spectators
+
+
+	def add(self, user):
+		global fan_out
+		if fan_out == None:
+			fan_out = FanOut(delay)
+			fan_out.start()
+
+		if user.outbox == None:
+			user.outbox = Outbox(user.sock)
+		with self.lock:
+			self.spectators[user] = monotonic()
+
+
+	def remove(self, user):
+		with self.lock:
+			return self.spectators.pop(user, None) != None
+
+
+	def clear(self):
+		with self.lock:
+			spectators = list(self.spectators)
+			self.spectators = {}
+		return spectators
+
+
+	def publish(self, data, route, json_encoder=None, only=None):
+		# Cheap enough for the game's hot path
+		if self.spectators:
+			fan_out.publish(self, data, route, json_encoder, only)
+
+
+	def deliver(self, published, data, route, json_encoder=None, only=None):
+		# A spectator removed while this runs can still get this event.
+		# Frames never interleave, all writes go through the outbox.
+		with self.lock:
+			spectators = list(self.spectators.items())
+
+		messages = {}
+		for spectator, joined in spectators:
+			if joined > published or (only != None and spectator != only):
+				continue
+
+			exchange_route = spectator.peer_reverse_exchange_routes.get(route)
+			if exchange_route == None:
+				continue
+
+			message = messages.get(exchange_route)
+			if message == None:
+				message = pack_message(data, exchange_route,
+					json_encoder=json_encoder)
+				messages[exchange_route] = message
+			try:
+				spectator.raw_send(message, binary=True)
+			except RuntimeError:
+				# Terminated, removed once closed() is called
+				pass
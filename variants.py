@@ -0,0 +1,85 @@
+"""
+House-rule variants of Uno. Importing this module registers them, hosts
+pick one with lobby_game.
+"""
+
+from cards import ALL_CARDS, TAKE_TWO, TAKE_FOUR
+from lobby import Uno, register_game
+
+
+# With a penalty pending only these cards can be played: +4 on anything,
+# +2 only on +2. Indexed by card id like cards.PLAYABLE, rebuilt by
+# hot_reload when the cards change.
+def build_tables():
+	global STACK_ON_TAKE_TWO, STACK_ON_TAKE_FOUR
+	STACK_ON_TAKE_TWO = bytes(card.face in (TAKE_TWO, TAKE_FOUR)
+		for card in ALL_CARDS)
+	STACK_ON_TAKE_FOUR = bytes(card.face == TAKE_FOUR for card in ALL_CARDS)
+
+build_tables()
+
+
+class StackingUno(Uno):
+	"""
+	+2 and +4 stack: instead of drawing right away the next player can
+	play another +2 or +4 and pass the sum on. Whoever can't (or doesn't)
+	draws all of it and their turn ends. +4 ends the turn like +2 does.
+	"""
+	name = "uno_stacking"
+
+	def __init__(self, lobby, turn_time=20.0, seed=None, debug=False):
+		# Cards the playing player has to draw unless they stack
+		self.penalty = 0
+		super().__init__(lobby, turn_time=turn_time, seed=seed, debug=debug)
+
+
+	def playable_cards(self):
+		if self.penalty == 0:
+			return super().playable_cards()
+		if self.top_card.face == TAKE_TWO:
+			return STACK_ON_TAKE_TWO
+		return STACK_ON_TAKE_FOUR
+
+
+	def apply_card(self, card, seat):
+		if card.face == TAKE_TWO:
+			self.penalty += 2
+			self.end_turn()
+		elif card.face == TAKE_FOUR:
+			self.penalty += 4
+			self.end_turn()
+		else:
+			super().apply_card(card, seat)
+
+
+	def take_penalty(self):
+		self.give_cards(self.penalty, self.playing_player)
+		self.penalty = 0
+
+
+	def draw(self, player):
+		if self.penalty == 0:
+			return super().draw(player)
+		# Drawing takes the whole penalty and ends the turn, even with a
+		# card to stack in hand
+		if player != self.playing_player:
+			return False
+		self.take_penalty()
+		self.end_turn()
+		return True
+
+
+	def end_turn(self, player_inc=1, time_expired=False):
+		if time_expired and self.penalty != 0:
+			self.take_penalty()
+		super().end_turn(player_inc=player_inc, time_expired=time_expired)
+
+
+	def player_leave(self, player):
+		# Nobody else has to draw for them
+		if player == self.playing_player:
+			self.penalty = 0
+		super().player_leave(player)
+
+
+register_game(StackingUno)